@@ -25,7 +25,7 @@ from model.faster_rcnn.resnet import resnet
 from model.faster_rcnn.vgg16 import vgg16
 from model.utils.config import cfg, cfg_from_file, cfg_fix
 from model.utils.net_utils import save_checkpoint
-from model.utils.net_utils import tensor_holder, ciod_old_and_new, flatten
+from model.utils.net_utils import ciod_old_and_new, flatten
 from roi_data_layer.roibatchLoader import roibatchLoader
 from roi_data_layer.roidb import combined_roidb
 
@@ -92,11 +92,7 @@ if __name__ == '__main__':
     del cfg_to_json["PIXEL_MEANS"]
     # json.dump(cfg_to_json, open(os.path.join(output_dir, 'config.json'), "w"), indent=4)
 
-    # initialize the tensor holders here.
-    im_data = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
-    im_info = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
-    num_boxes = tensor_holder(torch.LongTensor(1), cfg.CUDA, True)
-    gt_boxes = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
+    device = torch.device('cuda' if cfg.CUDA else 'cpu')
 
     # The representation classifier
     class_means = torch.zeros(2048, cfg.NUM_CLASSES + 1)
@@ -106,32 +102,34 @@ if __name__ == '__main__':
     group_cls, group_cls_arr, group_merged_arr = ciod_old_and_new(
         cfg.NUM_CLASSES, cfg.CIOD.GROUPS, cfg.CIOD.DISTILL_GROUP)
 
+    # Get the net once; each group below only swaps checkpoint weights in,
+    # so the pretrained backbone, the CUDA context and the cudnn autotuning
+    # caches are not rebuilt from cold on every group
+    if args.net == 'vgg16':
+        fasterRCNN = vgg16(cfg.CLASSES, pretrained=True, class_agnostic=args.class_agnostic)
+    elif args.net.startswith('res'):
+        fasterRCNN = resnet(cfg.CLASSES, int(args.net[3:]),
+                            pretrained=True, class_agnostic=args.class_agnostic)
+    else:
+        raise KeyError("Unknown Network")
+
+    fasterRCNN.create_architecture()
+
+    if cfg.CUDA:  # Send to GPU
+        if cfg.MGPU:
+            fasterRCNN = nn.DataParallel(fasterRCNN)
+        fasterRCNN.cuda()
+
     # Train ALL groups, or just ONE group
     start_group, end_group = (0, cfg.CIOD.GROUPS) if args.group == -1 else (args.group, args.group + 1)
 
     # Now we enter the group loop
     for group in trange(start_group, end_group, desc="Group", leave=True):
-        # Get the net
-        if args.net == 'vgg16':
-            fasterRCNN = vgg16(cfg.CLASSES, pretrained=True, class_agnostic=args.class_agnostic)
-        elif args.net.startswith('res'):
-            fasterRCNN = resnet(cfg.CLASSES, int(args.net[3:]),
-                                pretrained=True, class_agnostic=args.class_agnostic)
-        else:
-            raise KeyError("Unknown Network")
-
-        fasterRCNN.create_architecture()
-
         load_name = os.path.join(
             output_dir,
             'faster_rcnn_{}_{}_{}_{}.pth'.format(args.session, args.net, args.dataset, group))
         checkpoint = torch.load(load_name)
-        fasterRCNN.load_state_dict(checkpoint['model'])
-
-        if cfg.CUDA:  # Send to GPU
-            if cfg.MGPU:
-                fasterRCNN = nn.DataParallel(fasterRCNN)
-            fasterRCNN.cuda()
+        (fasterRCNN.module if cfg.MGPU else fasterRCNN).load_state_dict(checkpoint['model'])
 
         tqdm.write("Resume from {}".format(load_name))
 
@@ -150,7 +148,7 @@ if __name__ == '__main__':
         dataset = roibatchLoader(roidb, ratio_list, ratio_index, cfg.TRAIN.BATCH_SIZE, now_cls_high, training=True)
         dataloader = torch.utils.data.DataLoader(
             dataset, batch_size=cfg.TRAIN.BATCH_SIZE, sampler=sampler_batch,
-            num_workers=min(cfg.TRAIN.BATCH_SIZE * 2, os.cpu_count()))
+            num_workers=min(cfg.TRAIN.BATCH_SIZE * 2, os.cpu_count()), pin_memory=cfg.CUDA)
         tqdm.write('{:d} roidb entries'.format(len(roidb)))
 
         iters_per_epoch = train_size // cfg.TRAIN.BATCH_SIZE
@@ -166,14 +164,14 @@ if __name__ == '__main__':
         # fasterRCNN.eval()
         for _ in trange(iters_per_epoch, desc="Repr", leave=True):
             data = next(data_iter)
-            im_data.data.resize_(data[0].size()).copy_(data[0])
-            im_info.data.resize_(data[1].size()).copy_(data[1])
-            gt_boxes.data.resize_(data[2].size()).copy_(data[2])
-            num_boxes.data.resize_(data[3].size()).copy_(data[3])
+            im_data = data[0].to(device, non_blocking=True)
+            im_info = data[1].to(device, non_blocking=True)
+            gt_boxes = data[2].to(device, non_blocking=True)
+            num_boxes = data[3].to(device, non_blocking=True)
             im_path = list(data[4])
 
             fasterRCNN.zero_grad()
-            rois, cls_prob, bbox_pred, \
+            rois, cls_prob, bbox_pred, bbox_raw, \
             rpn_label, rpn_feature, rpn_cls_score, \
             rois_label, pooled_feat, cls_score, \
             rpn_loss_cls, rpn_loss_bbox, RCNN_loss_cls, RCNN_loss_bbox \
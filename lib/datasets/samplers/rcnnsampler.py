@@ -3,26 +3,60 @@ from torch.utils.data.sampler import Sampler
 
 
 class RcnnSampler(Sampler):
+    """Yield batch_size-contiguous index blocks in random block order.
+
+    Dataset indices are pre-sorted by aspect ratio (rank_roidb_ratio), so
+    every block is an aspect-ratio bucket: all samples in a batch share one
+    target ratio, padding waste stays minimal, and cudnn.benchmark only ever
+    sees a handful of distinct input shapes to autotune. The tail that cannot
+    fill a whole batch is dropped to keep batch shapes stable.
+    """
+
     def __init__(self, train_size, batch_size):
         self.num_data = train_size
         self.num_per_batch = int(train_size / batch_size)
         self.batch_size = batch_size
         self.range = torch.arange(0, batch_size).view(1, batch_size).long()
-        self.leftover_flag = False
-        if train_size % batch_size:
-            self.leftover = torch.arange(self.num_per_batch * batch_size, train_size).long()
-            self.leftover_flag = True
 
     def __iter__(self):
         rand_num = torch.randperm(self.num_per_batch).view(-1, 1) * self.batch_size
-        self.rand_num = rand_num.expand(self.num_per_batch, self.batch_size) + self.range
+        batches = rand_num.expand(self.num_per_batch, self.batch_size) + self.range
+        return iter(batches.contiguous().view(-1))
+
+    def __len__(self):
+        return self.num_per_batch * self.batch_size
 
-        self.rand_num_view = self.rand_num.view(-1)
 
-        if self.leftover_flag:
-            self.rand_num_view = torch.cat((self.rand_num_view, self.leftover), 0)
+class DistributedRcnnSampler(RcnnSampler):
+    """RcnnSampler that shards whole batches across distributed ranks.
 
-        return iter(self.rand_num_view)
+    Batches must stay contiguous index blocks so that ratio grouping in
+    roibatchLoader keeps working, hence we shard per batch instead of
+    wrapping torch.utils.data.DistributedSampler (which shards per sample).
+    """
+
+    def __init__(self, train_size, batch_size, num_replicas, rank):
+        super(DistributedRcnnSampler, self).__init__(train_size, batch_size)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        # Every rank must draw the same permutation for the round-robin
+        # split below to form a partition, so seed from the epoch.
+        g = torch.Generator()
+        g.manual_seed(self.epoch)
+        rand_num = torch.randperm(self.num_per_batch, generator=g).view(-1, 1) * self.batch_size
+        batches = rand_num.expand(self.num_per_batch, self.batch_size) + self.range
+        # Truncate to a multiple of num_replicas before sharding so every
+        # rank runs the same number of steps; an uneven split would leave
+        # some ranks waiting in DDP's all-reduce at the end of the epoch.
+        even = self.num_per_batch - self.num_per_batch % self.num_replicas
+        batches = batches[:even][self.rank::self.num_replicas]
+        return iter(batches.contiguous().view(-1))
 
     def __len__(self):
-        return self.num_data
+        return (self.num_per_batch // self.num_replicas) * self.batch_size
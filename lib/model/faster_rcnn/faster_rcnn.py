@@ -34,7 +34,7 @@ class _fasterRCNN(nn.Module):
         self.grid_size = cfg.POOLING_SIZE * 2 if cfg.CROP_RESIZE_WITH_MAX_POOL else cfg.POOLING_SIZE
         self.RCNN_roi_crop = _RoICrop()
 
-    def forward(self, im_data, im_info, gt_boxes, num_boxes):
+    def forward(self, im_data, im_info, gt_boxes, num_boxes, cls_high=None):
         batch_size = im_data.size(0)
 
         im_info = im_info.data
@@ -94,16 +94,24 @@ class _fasterRCNN(nn.Module):
                                             rois_label.view(rois_label.size(0), 1, 1).expand(rois_label.size(0), 1, 4))
             bbox_pred = bbox_pred_select.squeeze(1)
 
-        # compute object classification probability
-        cls_score = self.RCNN_cls_score(pooled_feat)
+        # compute object classification probability; when the caller only
+        # trains the first cls_high classes, evaluate just those rows of the
+        # classifier instead of producing full-width logits to be sliced
+        # (gradients still land in the shared full-width parameters)
+        if cls_high is None:
+            cls_score = self.RCNN_cls_score(pooled_feat)
+        else:
+            cls_score = F.linear(pooled_feat, self.RCNN_cls_score.weight[:cls_high],
+                                 self.RCNN_cls_score.bias[:cls_high])
         cls_prob = F.softmax(cls_score, dim=-1)
 
         RCNN_loss_cls = 0
         RCNN_loss_bbox = 0
 
         if self.training:
-            # classification loss
-            RCNN_loss_cls = F.cross_entropy(cls_score, rois_label)
+            # classification loss is computed by the caller from cls_score,
+            # sliced to the classes of the current group; computing it here
+            # over all classes would only be thrown away (see trainval_net)
 
             # bounding box regression L1 loss
             RCNN_loss_bbox = _smooth_l1_loss(bbox_pred, rois_target, rois_inside_ws, rois_outside_ws)
@@ -276,13 +276,17 @@ class resnet(_fasterRCNN):
         # Override train so that the training mode is set as we want
         nn.Module.train(self, mode)
         if mode:
-            # Set fixed blocks to be in eval mode
+            # Set fixed blocks to be in eval mode. Walk the children instead
+            # of indexing: a TorchScript-compiled backbone (TRAIN.JIT_BACKBONE)
+            # is not subscriptable, but still iterates in order.
             self.RCNN_base.eval()
-            self.RCNN_base[5].train()
-            self.RCNN_base[6].train()
+            for ith, block in enumerate(self.RCNN_base.children()):
+                if ith in (5, 6):  # layer2, layer3
+                    block.train()
 
             def set_bn_eval(m):
-                classname = m.__class__.__name__
+                # scripted modules report their original class via original_name
+                classname = getattr(m, 'original_name', m.__class__.__name__)
                 if classname.find('BatchNorm') != -1:
                     m.eval()
 
@@ -179,6 +179,15 @@ __C.TRAIN.USE_ALL_GT = True
 # Whether to tune the batch normalization parameters during training
 __C.TRAIN.BN_TRAIN = False
 
+# Whether to train with mixed precision (autocast + gradient scaling) on GPU
+__C.TRAIN.AMP = True
+
+# Number of iterations to accumulate gradients over before an optimizer step
+__C.TRAIN.GRAD_ACCUM = 1
+
+# Whether to compile the backbone (RCNN_base) with TorchScript
+__C.TRAIN.JIT_BACKBONE = True
+
 #
 # Testing options
 #
@@ -40,18 +40,9 @@ def weights_normal_init(model, dev=0.01):
 
 
 def clip_gradient(model, clip_norm):
-    """Computes a gradient clipping coefficient based on gradient norm."""
-    totalnorm = 0
-    for p in model.parameters():
-        if p.requires_grad:
-            modulenorm = p.grad.data.norm()
-            totalnorm += modulenorm ** 2
-    totalnorm = np.sqrt(totalnorm)
-
-    norm = clip_norm / max(totalnorm, clip_norm)
-    for p in model.parameters():
-        if p.requires_grad:
-            p.grad.mul_(norm)
+    """Clip the global gradient norm with the fused multi-tensor kernel."""
+    nn.utils.clip_grad_norm_(
+        (p for p in model.parameters() if p.requires_grad), clip_norm, foreach=True)
 
 
 def vis_detections(im, class_name, dets, thresh=0.8):
@@ -267,36 +258,68 @@ def heat_exp(data, temperature):
     return data / temperature
 
 
-def tensor_holder(data, cuda=False, variable=False):
-    if cuda:
-        data = data.cuda()
-    if variable:
-        data = Variable(data)
-    return data
+class CudaPrefetcher(object):
+    """Iterate a DataLoader while staging each batch onto the GPU early.
+
+    Tensor elements of the next batch are copied with non_blocking copies
+    issued on a dedicated side stream, so batch t+1's H2D transfer runs on
+    the DMA engine while batch t is still computing. The consumer stream
+    waits on the copy stream before a batch is handed out, and
+    record_stream keeps the device memory alive until the consumer is done
+    with it.
+    """
+
+    def __init__(self, dataloader, device):
+        self.dataloader = dataloader
+        self.device = device
+        self.stream = torch.cuda.Stream(device)
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def _preload(self, data_iter):
+        try:
+            cpu_data = next(data_iter)
+        except StopIteration:
+            self.next_cpu_data = self.next_data = None
+            return
+        with torch.cuda.stream(self.stream):
+            self.next_data = [x.to(self.device, non_blocking=True) if torch.is_tensor(x) else x
+                              for x in cpu_data]
+        # keep the pinned host batch referenced until its copies are consumed
+        self.next_cpu_data = cpu_data
+
+    def __iter__(self):
+        data_iter = iter(self.dataloader)
+        self._preload(data_iter)
+        while self.next_data is not None:
+            torch.cuda.current_stream().wait_stream(self.stream)
+            data = self.next_data
+            for x in data:
+                if torch.is_tensor(x):
+                    x.record_stream(torch.cuda.current_stream())
+            self._preload(data_iter)
+            yield data
 
 
 def ciod_old_and_new(tot_cls, tot_group, sep_group):
-    group_cls = [1]
-    group_cls_arr = []
-    group_merged_arr = []
+    # Class boundaries in one shot: classes 1..tot_cls split evenly over the
+    # groups, with slot 0 reserved for __background__
+    bounds = tot_cls * np.arange(tot_group + 1) // tot_group + 1
+    group_cls = bounds.tolist()
+    new_cls_arr = [np.arange(low, high) for low, high in zip(bounds[:-1], bounds[1:])]
 
-    low = group_cls[-1]
+    group_merged_arr = []
     for group in range(tot_group):
-        high = tot_cls * (group + 1) // tot_group + 1
-        group_cls.append(high)
-        group_cls_arr.append(np.arange(low, high).tolist())
-        low = high
-
         if group:
             if sep_group:
-                tmp = [[0] + x for x in group_cls_arr[:-1]]
+                tmp = [np.concatenate(([0], x)) for x in new_cls_arr[:group]]
             else:
-                tmp = [[0] + np.concatenate(group_cls_arr[:-1]).tolist()]
+                tmp = [np.concatenate([[0]] + new_cls_arr[:group])]
         else:
-            tmp = [[0]]
+            tmp = [np.array([0])]
         group_merged_arr.append(tmp)
-    group_cls_arr = [np.array([0] + x) for x in group_cls_arr]
-    group_merged_arr = [[np.array(x) for x in y] for y in group_merged_arr]
+    group_cls_arr = [np.concatenate(([0], x)) for x in new_cls_arr]
     return group_cls, group_cls_arr, group_merged_arr
 
 
@@ -30,24 +30,17 @@ class roibatchLoader(data.Dataset):
         self.data_size = len(self.ratio_list)
         self.shuffle = shuffle
 
-        # given the ratio_list, we want to make the ratio same for each batch.
-        self.ratio_list_batch = torch.Tensor(self.data_size).zero_()
-        num_batch = int(np.ceil(len(ratio_index) / batch_size))
-        for i in range(num_batch):
-            left_idx = i * batch_size
-            right_idx = min((i + 1) * batch_size - 1, self.data_size - 1)
-
-            if ratio_list[right_idx] < 1:
-                # for ratio < 1, we preserve the leftmost in each batch.
-                target_ratio = ratio_list[left_idx]
-            elif ratio_list[left_idx] > 1:
-                # for ratio > 1, we preserve the rightmost in each batch.
-                target_ratio = ratio_list[right_idx]
-            else:
-                # for ratio cross 1, we make it to be 1.
-                target_ratio = 1
-
-            self.ratio_list_batch[left_idx:(right_idx + 1)] = target_ratio
+        # given the ratio_list, we want to make the ratio same for each batch:
+        # for a batch entirely below 1 keep its leftmost ratio, entirely above
+        # 1 its rightmost, and 1 for batches that cross it. ratio_list is
+        # sorted, so this is three vectorized selections over the batch edges.
+        ratio_arr = np.asarray(ratio_list)
+        left_idx = np.arange(0, self.data_size, batch_size)
+        right_idx = np.minimum(left_idx + batch_size - 1, self.data_size - 1)
+        target_ratio = np.where(ratio_arr[right_idx] < 1, ratio_arr[left_idx],
+                                np.where(ratio_arr[left_idx] > 1, ratio_arr[right_idx], 1.))
+        self.ratio_list_batch = torch.from_numpy(
+            np.repeat(target_ratio, batch_size)[:self.data_size]).float()
 
     def __getitem__(self, index):
         if self.training:
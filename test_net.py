@@ -26,7 +26,7 @@ from model.nms.nms_wrapper import nms
 from model.rpn.bbox_transform import bbox_transform_inv
 from model.rpn.bbox_transform import clip_boxes
 from model.utils.config import cfg, cfg_from_file, get_output_dir, cfg_fix
-from model.utils.net_utils import vis_detections, tensor_holder
+from model.utils.net_utils import vis_detections
 from roi_data_layer.roibatchLoader import roibatchLoader
 from roi_data_layer.roidb import combined_roidb
 
@@ -99,11 +99,7 @@ if __name__ == '__main__':
     if cfg.CUDA:
         fasterRCNN.cuda()
 
-    # initilize the tensor holder here.
-    im_data = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
-    im_info = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
-    num_boxes = tensor_holder(torch.LongTensor(1), cfg.CUDA, True)
-    gt_boxes = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
+    device = torch.device('cuda' if cfg.CUDA else 'cpu')
 
     max_per_image = 100
     thresh = 0.05 if args.vis else 0.0
@@ -145,10 +141,10 @@ if __name__ == '__main__':
         data_iter = iter(dataloader)
         for i in trange(num_images, desc="Iter", leave=True):
             data = next(data_iter)
-            im_data.data.resize_(data[0].size()).copy_(data[0])
-            im_info.data.resize_(data[1].size()).copy_(data[1])
-            gt_boxes.data.resize_(data[2].size()).copy_(data[2])
-            num_boxes.data.resize_(data[3].size()).copy_(data[3])
+            im_data = data[0].to(device, non_blocking=True)
+            im_info = data[1].to(device, non_blocking=True)
+            gt_boxes = data[2].to(device, non_blocking=True)
+            num_boxes = data[3].to(device, non_blocking=True)
 
             rois, cls_prob, bbox_pred, bbox_raw, \
             rpn_label, rpn_feature, rpn_cls_score, \
@@ -12,23 +12,27 @@ import json
 import os
 import pickle
 import pprint
+import queue
+import threading
 from copy import deepcopy
 
 import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
 from scipy.spatial.distance import cdist
 from tensorboardX import SummaryWriter
+from torch.nn.parallel import DistributedDataParallel
 from tqdm import tqdm, trange
 
 import _init_paths
-from datasets.samplers.rcnnsampler import RcnnSampler
+from datasets.samplers.rcnnsampler import DistributedRcnnSampler, RcnnSampler
 from model.faster_rcnn.resnet import resnet
 from model.faster_rcnn.vgg16 import vgg16
 from model.utils.config import cfg, cfg_fix, cfg_from_file
 from model.utils.net_utils import adjust_learning_rate, clip_gradient, save_checkpoint, set_learning_rate
-from model.utils.net_utils import change_require_gradient, ciod_old_and_new, flatten, heat_exp, tensor_holder
+from model.utils.net_utils import CudaPrefetcher, change_require_gradient, ciod_old_and_new, flatten, heat_exp
 from roi_data_layer.roibatchLoader import roibatchLoader
 from roi_data_layer.roidb import combined_roidb
 
@@ -70,8 +74,6 @@ if __name__ == '__main__':
     print('Called with args:')
     print(args)
 
-    logger = SummaryWriter(os.path.join('logs', '{}_{}'.format(args.session, args.dataset)))
-
     args.imdb_name = "voc_{}_trainval".format(args.dataset)
     args.imdbval_name = "voc_{}_test".format(args.dataset)
     cfg_from_file("cfgs/{}{}.yml".format(args.net, "_ls" if args.large_scale else ""))
@@ -80,21 +82,62 @@ if __name__ == '__main__':
 
     cfg_fix()
 
+    # One process per GPU when launched via `torchrun --nproc_per_node=N`;
+    # NCCL all-reduce replaces the DataParallel scatter/gather path.
+    distributed = int(os.environ.get('WORLD_SIZE', 1)) > 1
+    if distributed:
+        dist.init_process_group(backend='nccl')
+        local_rank = int(os.environ['LOCAL_RANK'])
+        torch.cuda.set_device(local_rank)
+        cfg.MGPU = False
+        # cfg_fix() sized BATCH_SIZE as a DataParallel-era global batch
+        # (device_count * 3); under torchrun every rank drives a single GPU
+        # but still sees all devices, so split it back into the per-GPU
+        # batch to keep the global batch (and memory use) unchanged.
+        cfg.TRAIN.BATCH_SIZE = max(1, cfg.TRAIN.BATCH_SIZE // dist.get_world_size())
+    is_main_process = not distributed or dist.get_rank() == 0
+
+    # Scalar writes are protobuf + filesystem I/O; drain them on a background
+    # thread so the training loop never blocks on the log directory. Only
+    # rank 0 writes, otherwise every torchrun process logs duplicate scalars.
+    log_queue = queue.Queue()
+    if is_main_process:
+        logger = SummaryWriter(os.path.join('logs', '{}_{}'.format(args.session, args.dataset)))
+
+        def drain_log_queue():
+            while True:
+                tag, value, step = log_queue.get()
+                try:
+                    logger.add_scalar(tag, value, step)
+                except Exception as e:
+                    tqdm.write("TensorBoard write failed: {}".format(e))
+                finally:
+                    # always mark the item done, so one failed write can
+                    # neither kill the thread nor hang log_queue.join()
+                    log_queue.task_done()
+
+        threading.Thread(target=drain_log_queue, daemon=True).start()
+
     print('Using config:')
     pprint.pprint(cfg)
     np.random.seed(cfg.RNG_SEED)
 
+    # Convolutions are the hot spot: let cuDNN autotune kernels for the
+    # (few, thanks to aspect-ratio grouping) input shapes we feed it, and
+    # allow TF32 math on Ampere+ Tensor Cores.
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
     output_dir = os.path.join(args.save_dir, str(args.session), args.net, args.dataset)
     os.makedirs(output_dir, exist_ok=True)
     cfg_to_json = deepcopy(cfg)
     del cfg_to_json["PIXEL_MEANS"]
     json.dump(cfg_to_json, open(os.path.join(output_dir, 'config.json'), "w"), indent=4)
 
-    # initialize the tensor holders here.
-    im_data = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
-    im_info = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
-    num_boxes = tensor_holder(torch.LongTensor(1), cfg.CUDA, True)
-    gt_boxes = tensor_holder(torch.FloatTensor(1), cfg.CUDA, True)
+    # Batches come out of the DataLoader already in pinned (page-locked) memory,
+    # so the H2D copies below can be asynchronous and overlap with compute.
+    device = torch.device('cuda' if cfg.CUDA else 'cpu')
 
     # The representation classifier
     class_means = torch.zeros(2048, cfg.NUM_CLASSES + 1)
@@ -120,41 +163,94 @@ if __name__ == '__main__':
         checkpoint = torch.load(load_name)
         fasterRCNN.load_state_dict(checkpoint['model'])
 
+    if cfg.TRAIN.JIT_BACKBONE:
+        # Scripting only the backbone lets the TorchScript fuser merge its
+        # conv/BN/ReLU/add chains into fewer kernels; the RPN head and ROI
+        # pooling stay eager since they use data-dependent control flow and
+        # custom extensions that do not script.
+        eager_base, b_eager_base = fasterRCNN.RCNN_base, b_fasterRCNN.RCNN_base
+        try:
+            fasterRCNN.RCNN_base = torch.jit.script(eager_base)
+            b_fasterRCNN.RCNN_base = torch.jit.script(b_eager_base)
+            # exercise the train() override (it walks the backbone's children)
+            # here, so an incompatibility falls back instead of crashing at
+            # the first fasterRCNN.train() of the group loop
+            fasterRCNN.train()
+        except Exception as e:
+            fasterRCNN.RCNN_base, b_fasterRCNN.RCNN_base = eager_base, b_eager_base
+            tqdm.write("TorchScript backbone disabled, running eager: {}".format(e))
+
     if cfg.CUDA:  # Send to GPU
-        if cfg.MGPU:
-            fasterRCNN = nn.DataParallel(fasterRCNN)
-            # b_fasterRCNN = nn.DataParallel(b_fasterRCNN)
         fasterRCNN.cuda()
         b_fasterRCNN.cuda()
+        # NHWC is the layout Tensor Core convolution kernels consume natively
+        fasterRCNN = fasterRCNN.to(memory_format=torch.channels_last)
+        b_fasterRCNN = b_fasterRCNN.to(memory_format=torch.channels_last)
+        if distributed:
+            fasterRCNN = DistributedDataParallel(
+                fasterRCNN, device_ids=[local_rank],
+                find_unused_parameters=False, gradient_as_bucket_view=True)
+        elif cfg.MGPU:
+            fasterRCNN = nn.DataParallel(fasterRCNN)
+            # b_fasterRCNN = nn.DataParallel(b_fasterRCNN)
 
     # How to optimize
+    # Bucket parameters by (role, bias-ness) into a handful of optimizer
+    # groups instead of one group per tensor, so optimizer.step() walks a few
+    # groups in Python rather than hundreds. RPN-classifier and base-net
+    # parameters get their own buckets because set_learning_rate() below
+    # freezes them by param-group index.
     params = []
     rpn_cls_params_index = []
     base_net_params_index = []
     lr = cfg.TRAIN.LEARNING_RATE
 
-    for key, value in dict(fasterRCNN.named_parameters()).items():  # since we froze some layers
-        if value.requires_grad:
-            ith = len(params)
-            if 'RCNN_rpn.RPN_cls_score' in key:  # Record the parameter position of RPN_cls_score
-                rpn_cls_params_index.append(ith)
-            if 'RCNN_base' in key:
-                base_net_params_index.append(ith)
-
-            if 'bias' in key:
-                params += [{'params': [value], 'lr': lr * (cfg.TRAIN.DOUBLE_BIAS + 1),
-                            'weight_decay': cfg.TRAIN.BIAS_DECAY and cfg.TRAIN.WEIGHT_DECAY or 0}]
-            else:
-                params += [{'params': [value], 'lr': lr, 'weight_decay': cfg.TRAIN.WEIGHT_DECAY}]
-
+    param_buckets = {}
+    for key, value in fasterRCNN.named_parameters():  # since we froze some layers
+        if not value.requires_grad:
+            continue
+        if 'RCNN_rpn.RPN_cls_score' in key:
+            role = 'rpn_cls'
+        elif 'RCNN_base' in key:
+            role = 'base'
+        else:
+            role = 'other'
+        param_buckets.setdefault((role, 'bias' in key), []).append(value)
+
+    for (role, is_bias), bucket in param_buckets.items():
+        ith = len(params)
+        if role == 'rpn_cls':  # Record the parameter position of RPN_cls_score
+            rpn_cls_params_index.append(ith)
+        elif role == 'base':
+            base_net_params_index.append(ith)
+
+        if is_bias:
+            params += [{'params': bucket, 'lr': lr * (cfg.TRAIN.DOUBLE_BIAS + 1),
+                        'weight_decay': cfg.TRAIN.BIAS_DECAY and cfg.TRAIN.WEIGHT_DECAY or 0}]
+        else:
+            params += [{'params': bucket, 'lr': lr, 'weight_decay': cfg.TRAIN.WEIGHT_DECAY}]
+
+    # foreach executes each update stage as one multi-tensor-apply kernel
+    # across all parameters of a group instead of a Python loop of
+    # single-tensor kernels
     if cfg.TRAIN.OPTIMIZER == "adam":
         lr = lr * 0.1
-        optimizer = torch.optim.Adam(params)
+        optimizer = torch.optim.Adam(params, foreach=True)
     elif cfg.TRAIN.OPTIMIZER == "sgd":
-        optimizer = torch.optim.SGD(params, momentum=cfg.TRAIN.MOMENTUM)
+        optimizer = torch.optim.SGD(params, momentum=cfg.TRAIN.MOMENTUM, foreach=True)
     else:
         raise KeyError("Unknown Optimizer")
 
+    # Mixed precision: autocast moves convs/matmuls/ROI ops onto Tensor
+    # Cores while losses and reductions stay in FP32. BF16 keeps FP32's
+    # exponent range (bbox regression targets are not well-bounded), so on
+    # Ampere+ the GradScaler and its overflow bookkeeping are skipped
+    # entirely; older GPUs fall back to FP16 with gradient scaling.
+    amp_enabled = cfg.CUDA and cfg.TRAIN.AMP
+    amp_dtype = torch.bfloat16 if amp_enabled and torch.cuda.is_bf16_supported() else torch.float16
+    scaler = torch.cuda.amp.GradScaler(enabled=amp_enabled and amp_dtype is torch.float16)
+    grad_accum = max(1, cfg.TRAIN.GRAD_ACCUM)
+
     if args.group > 0:  # And load the status here
         optimizer.load_state_dict(checkpoint['optimizer'])
         cfg.POOLING_MODE = checkpoint['pooling_mode']
@@ -194,130 +290,160 @@ if __name__ == '__main__':
             data_extra=flatten(class_proto[:now_cls_low], distinct=True))
 
         train_size = len(roidb)
-        sampler_batch = RcnnSampler(train_size, cfg.TRAIN.BATCH_SIZE)
+        if distributed:
+            sampler_batch = DistributedRcnnSampler(
+                train_size, cfg.TRAIN.BATCH_SIZE, dist.get_world_size(), dist.get_rank())
+        else:
+            sampler_batch = RcnnSampler(train_size, cfg.TRAIN.BATCH_SIZE)
         dataset = roibatchLoader(roidb, ratio_list, ratio_index, cfg.TRAIN.BATCH_SIZE, now_cls_high, training=True)
+        # Keep workers alive (and their prefetch queues warm) across the epoch
+        # boundaries below; worker count is independent of the batch size so
+        # preprocessing never becomes the bottleneck.
         dataloader = torch.utils.data.DataLoader(
             dataset, batch_size=cfg.TRAIN.BATCH_SIZE, sampler=sampler_batch,
-            num_workers=min(cfg.TRAIN.BATCH_SIZE * 2, os.cpu_count()))
+            num_workers=min(16, os.cpu_count()), persistent_workers=True, prefetch_factor=4,
+            pin_memory=cfg.CUDA)
+        if cfg.CUDA:
+            # batch t+1 is copied on a side stream while batch t computes
+            dataloader = CudaPrefetcher(dataloader, device)
         tqdm.write('{:d} roidb entries'.format(len(roidb)))
 
         # Get weights from the previous group
-        b_fasterRCNN.load_state_dict((fasterRCNN.module if cfg.MGPU else fasterRCNN).state_dict())
+        b_fasterRCNN.load_state_dict((fasterRCNN.module if (cfg.MGPU or distributed) else fasterRCNN).state_dict())
         change_require_gradient(b_fasterRCNN, False)
 
-        iters_per_epoch = train_size // cfg.TRAIN.BATCH_SIZE
-
         tot_step = 0
+        optimizer.zero_grad(set_to_none=True)
 
         # Here is the training loop
         for epoch in trange(cfg.TRAIN.MAX_EPOCH, desc="Epoch", leave=True):
-            loss_temp = 0
+            # Running [loss, rpn_cls, rpn_box, rcnn_cls, rcnn_box, fg] kept on
+            # the GPU so per-iteration accumulation never synchronizes with the
+            # host; the ROI count is plain metadata and stays host-side
+            log_buf = torch.zeros(6, device=device)
+            roi_cnt = 0
 
             if epoch % cfg.TRAIN.LEARNING_RATE_DECAY_STEP == 0 and epoch > 0:
                 adjust_learning_rate(optimizer, cfg.TRAIN.LEARNING_RATE_DECAY_GAMMA)
                 lr *= cfg.TRAIN.LEARNING_RATE_DECAY_GAMMA
 
-            data_iter = iter(dataloader)
-            for _ in trange(iters_per_epoch, desc="Iter", leave=True):
+            if distributed:
+                sampler_batch.set_epoch(epoch)
+
+            # Iterate the loader directly: the sampler emits exactly the full
+            # batches of the epoch, and skipping the per-iteration progress
+            # bar keeps stderr flushing and its lock off the hot path (the
+            # epoch-level bar still shows progress).
+            for data in dataloader:
                 tot_step += 1
-                data = next(data_iter)
-                im_data.data.resize_(data[0].size()).copy_(data[0])
-                im_info.data.resize_(data[1].size()).copy_(data[1])
-                gt_boxes.data.resize_(data[2].size()).copy_(data[2])
-                num_boxes.data.resize_(data[3].size()).copy_(data[3])
+                im_data = data[0].to(device, non_blocking=True, memory_format=torch.channels_last)
+                im_info = data[1].to(device, non_blocking=True)
+                gt_boxes = data[2].to(device, non_blocking=True)
+                num_boxes = data[3].to(device, non_blocking=True)
                 im_path = list(data[4])
 
-                fasterRCNN.zero_grad()
-                rois, cls_prob, bbox_pred, bbox_raw, \
-                rpn_label, rpn_feature, rpn_cls_score, \
-                rois_label, pooled_feat, cls_score, \
-                rpn_loss_cls, rpn_loss_bbox, RCNN_loss_cls, RCNN_loss_bbox \
-                    = fasterRCNN(im_data, im_info, gt_boxes, num_boxes)
-
-                RCNN_loss_bbox_distill = 0
-                cls_score = cls_score[:, :now_cls_high].contiguous()
-
-                if (0 != group) and (cfg.CIOD.SWITCH_DO_IN_RPN or cfg.CIOD.SWITCH_DO_IN_FRCN):
-                    # Get result from the backup net
-                    b_rois, b_cls_prob, b_bbox_pred, b_bbox_raw, \
-                    b_rpn_label, b_rpn_feature, b_rpn_cls_score, \
-                    b_rois_label, b_pooled_feat, b_cls_score, \
-                    b_rpn_loss_cls, b_rpn_loss_bbox, b_RCNN_loss_cls, b_RCNN_loss_bbox \
-                        = b_fasterRCNN(im_data, im_info, gt_boxes, num_boxes)
-
-                    b_cls_score = b_cls_score[:, :now_cls_low].contiguous()
-
-                    if cfg.CIOD.SWITCH_DO_IN_RPN:
-                        # RPN binary classification loss
-                        # Less-forgetting Learning in Deep Neural Networks (Equ 1)
-                        rpn_loss_cls_old = F.mse_loss(rpn_feature, b_rpn_feature)  # To make change small?
-                        rpn_loss_cls_new = F.cross_entropy(rpn_cls_score, rpn_label)
-                        rpn_loss_cls = cfg.CIOD.RPN_CLS_LOSS_SCALE_FEATURE * rpn_loss_cls_old + rpn_loss_cls_new
-
-                    if cfg.CIOD.SWITCH_DO_IN_FRCN:
-                        # Classification loss in Fast R-CNN
-                        # For old class, use knowledge distillation with KLDivLoss
-                        loss_frcn_cls_old = 0
-                        for index_old in group_merged_arr[group]:
-                            label_old = F.log_softmax(heat_exp(b_cls_score[:, index_old], cfg.CIOD.TEMPERATURE), -1)
-                            pred_old = F.softmax(heat_exp(cls_score[:, index_old], cfg.CIOD.TEMPERATURE))
-                            if cfg.CIOD.DISTILL_METHOD == 'kldiv':
-                                loss_frcn_cls_old += F.kl_div(pred_old, label_old)
-                            elif cfg.CIOD.DISTILL_METHOD == 'mse':
-                                loss_frcn_cls_old += F.mse_loss(pred_old, label_old)
-                            else:
-                                raise KeyError("Unknown distill method")
-
-                        # For new classes, use cross entropy loss
-                        # label_new = torch.max(torch.zeros_like(rois_label), rois_label - now_cls_low + 1)
-                        # pred_new = cls_score.index_select(1, group_cls_arr[group]).contiguous()
-                        # loss_frcn_cls_new = F.cross_entropy(pred_new, label_new)
-                        loss_frcn_cls_new = F.cross_entropy(cls_score, rois_label)
-
-                        # Process class 0 (__background__)
-                        # If it is background class, we do not want to change it too much
-                        if cfg.CIOD.DISTILL_BACKGROUND:
-                            zero_label_mask = (rois_label == 0).nonzero().squeeze()
-                            label_zero_f = cls_score.index_select(0, zero_label_mask)
-                            pred_zero_f = cls_score.index_select(0, zero_label_mask)
-                            loss_cls_zero = F.mse_loss(pred_zero_f, label_zero_f)
-
-                        # Total classification loss
-                        RCNN_loss_cls = cfg.CIOD.LOSS_SCALE_DISTILL * loss_frcn_cls_old + loss_frcn_cls_new
-                        if cfg.CIOD.DISTILL_BACKGROUND:
-                            RCNN_loss_cls += loss_cls_zero
-
-                        if cfg.CIOD.DISTILL_BOUNDINGBOX and not args.class_agnostic:
-                            real_shape = [cls_prob.shape[0], cls_prob.shape[1], cfg.NUM_CLASSES + 1, 4]
-                            bbox_raw = bbox_raw.view(real_shape)[:, :, :now_cls_low, :]
-                            b_bbox_raw = b_bbox_raw.view(real_shape)[:, :, :now_cls_low, :]
-                            RCNN_loss_bbox_distill = cfg.CIOD.LOSS_SCALE_DISTILL * F.mse_loss(bbox_raw, b_bbox_raw)
-
-                else:
-                    RCNN_loss_cls = F.cross_entropy(cls_score, rois_label)
-
-                loss = rpn_loss_cls.mean() + rpn_loss_bbox.mean() \
-                       + RCNN_loss_cls.mean() + RCNN_loss_bbox.mean() + RCNN_loss_bbox_distill
-
-                loss_temp += loss.data[0]
-
-                # backward
-                optimizer.zero_grad()
-                loss.backward()
-                if args.net == "vgg16":
-                    clip_gradient(fasterRCNN, 10.)
-                optimizer.step()
+                with torch.cuda.amp.autocast(enabled=amp_enabled, dtype=amp_dtype):
+                    rois, cls_prob, bbox_pred, bbox_raw, \
+                    rpn_label, rpn_feature, rpn_cls_score, \
+                    rois_label, pooled_feat, cls_score, \
+                    rpn_loss_cls, rpn_loss_bbox, RCNN_loss_cls, RCNN_loss_bbox \
+                        = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, cls_high=now_cls_high)
+
+                    RCNN_loss_bbox_distill = 0
+
+                    if (0 != group) and (cfg.CIOD.SWITCH_DO_IN_RPN or cfg.CIOD.SWITCH_DO_IN_FRCN):
+                        # Get result from the backup net
+                        b_rois, b_cls_prob, b_bbox_pred, b_bbox_raw, \
+                        b_rpn_label, b_rpn_feature, b_rpn_cls_score, \
+                        b_rois_label, b_pooled_feat, b_cls_score, \
+                        b_rpn_loss_cls, b_rpn_loss_bbox, b_RCNN_loss_cls, b_RCNN_loss_bbox \
+                            = b_fasterRCNN(im_data, im_info, gt_boxes, num_boxes, cls_high=now_cls_low)
+
+                        if cfg.CIOD.SWITCH_DO_IN_RPN:
+                            # RPN binary classification loss
+                            # Less-forgetting Learning in Deep Neural Networks (Equ 1)
+                            rpn_loss_cls_old = F.mse_loss(rpn_feature, b_rpn_feature)  # To make change small?
+                            rpn_loss_cls_new = F.cross_entropy(rpn_cls_score, rpn_label)
+                            rpn_loss_cls = cfg.CIOD.RPN_CLS_LOSS_SCALE_FEATURE * rpn_loss_cls_old + rpn_loss_cls_new
+
+                        if cfg.CIOD.SWITCH_DO_IN_FRCN:
+                            # Classification loss in Fast R-CNN
+                            # For old class, use knowledge distillation with KLDivLoss
+                            loss_frcn_cls_old = 0
+                            for index_old in group_merged_arr[group]:
+                                label_old = F.log_softmax(heat_exp(b_cls_score[:, index_old], cfg.CIOD.TEMPERATURE), -1)
+                                pred_old = F.softmax(heat_exp(cls_score[:, index_old], cfg.CIOD.TEMPERATURE))
+                                if cfg.CIOD.DISTILL_METHOD == 'kldiv':
+                                    loss_frcn_cls_old += F.kl_div(pred_old, label_old)
+                                elif cfg.CIOD.DISTILL_METHOD == 'mse':
+                                    loss_frcn_cls_old += F.mse_loss(pred_old, label_old)
+                                else:
+                                    raise KeyError("Unknown distill method")
+
+                            # For new classes, use cross entropy loss
+                            # label_new = torch.max(torch.zeros_like(rois_label), rois_label - now_cls_low + 1)
+                            # pred_new = cls_score.index_select(1, group_cls_arr[group]).contiguous()
+                            # loss_frcn_cls_new = F.cross_entropy(pred_new, label_new)
+                            loss_frcn_cls_new = F.cross_entropy(cls_score, rois_label)
+
+                            # Process class 0 (__background__)
+                            # If it is background class, we do not want to change it too much
+                            if cfg.CIOD.DISTILL_BACKGROUND:
+                                zero_label_mask = (rois_label == 0).nonzero().squeeze()
+                                label_zero_f = cls_score.index_select(0, zero_label_mask)
+                                pred_zero_f = cls_score.index_select(0, zero_label_mask)
+                                loss_cls_zero = F.mse_loss(pred_zero_f, label_zero_f)
+
+                            # Total classification loss
+                            RCNN_loss_cls = cfg.CIOD.LOSS_SCALE_DISTILL * loss_frcn_cls_old + loss_frcn_cls_new
+                            if cfg.CIOD.DISTILL_BACKGROUND:
+                                RCNN_loss_cls += loss_cls_zero
+
+                            if cfg.CIOD.DISTILL_BOUNDINGBOX and not args.class_agnostic:
+                                real_shape = [cls_prob.shape[0], cls_prob.shape[1], cfg.NUM_CLASSES + 1, 4]
+                                bbox_raw = bbox_raw.view(real_shape)[:, :, :now_cls_low, :]
+                                b_bbox_raw = b_bbox_raw.view(real_shape)[:, :, :now_cls_low, :]
+                                RCNN_loss_bbox_distill = cfg.CIOD.LOSS_SCALE_DISTILL * F.mse_loss(bbox_raw, b_bbox_raw)
+
+                    if (0 == group) or not cfg.CIOD.SWITCH_DO_IN_FRCN:
+                        # Plain classification loss; the RPN-only distill
+                        # ablation (SWITCH_DO_IN_RPN without SWITCH_DO_IN_FRCN)
+                        # needs it too
+                        RCNN_loss_cls = F.cross_entropy(cls_score, rois_label)
+
+                    # Stack the per-term means and reduce once, so the total
+                    # is a single kernel instead of a chain of scalar adds,
+                    # and the display branch can reuse `losses` instead of
+                    # re-reducing each term.
+                    losses = torch.stack([rpn_loss_cls.mean(), rpn_loss_bbox.mean(),
+                                          RCNN_loss_cls.mean(), RCNN_loss_bbox.mean()])
+                    loss = losses.sum() + RCNN_loss_bbox_distill
+
+                log_buf += torch.cat((loss.detach().view(1), losses.detach(),
+                                      rois_label.ne(0).sum().view(1).to(log_buf.dtype)))
+                roi_cnt += rois_label.numel()
+
+                # backward; gradients accumulate over GRAD_ACCUM iterations
+                scaler.scale(loss / grad_accum).backward()
+                if tot_step % grad_accum == 0:
+                    if args.net == "vgg16":
+                        scaler.unscale_(optimizer)  # clip real (unscaled) gradients
+                        clip_gradient(fasterRCNN, 10.)
+                    scaler.step(optimizer)
+                    scaler.update()
+                    # set_to_none skips the full-parameter zero-fill sweep
+                    optimizer.zero_grad(set_to_none=True)
 
                 if tot_step % cfg.TRAIN.DISPLAY == 0:
-                    if tot_step > 0:
-                        loss_temp /= cfg.TRAIN.DISPLAY
-
-                    loss_rpn_cls = rpn_loss_cls.mean().data[0]
-                    loss_rpn_box = rpn_loss_bbox.mean().data[0]
-                    loss_rcnn_cls = RCNN_loss_cls.mean().data[0]
-                    loss_rcnn_box = RCNN_loss_bbox.mean().data[0]
-                    fg_cnt = torch.sum(rois_label.data.ne(0))
-                    bg_cnt = rois_label.data.numel() - fg_cnt
+                    # The only D2H transfer of the window: fetch the averaged
+                    # scalars in one copy, then reset the accumulator in place
+                    loss_temp, loss_rpn_cls, loss_rpn_box, loss_rcnn_cls, loss_rcnn_box, fg_avg = \
+                        (log_buf / cfg.TRAIN.DISPLAY).tolist()
+                    log_buf.zero_()
+                    # per-iteration averages; bg is derived host-side
+                    fg_cnt = int(fg_avg)
+                    bg_cnt = roi_cnt // cfg.TRAIN.DISPLAY - fg_cnt
+                    roi_cnt = 0
 
                     tqdm.write("[S{} G{}] lr: {:.2}, loss: {:.4}, fg/bg=({}/{})\n"
                                "\t\t\trpn_cls: {:.4}, rpn_box: {:.4}, rcnn_cls: {:.4}, rcnn_box {:.4}".format(
@@ -332,20 +458,19 @@ if __name__ == '__main__':
                         'loss_rcnn_box': loss_rcnn_box,
                         'learning_rate': lr
                     }
-                    for tag, value in info.items():
-                        logger.add_scalar("Group{}/{}".format(group, tag), value, tot_step)
-
-                    loss_temp = 0
+                    if is_main_process:
+                        for tag, value in info.items():
+                            log_queue.put(("Group{}/{}".format(group, tag), value, tot_step))
 
         if cfg.CIOD.REPRESENTATION:
-            if args.save_without_repr:  # We can save weights before representation learning
+            if args.save_without_repr and is_main_process:  # We can save weights before representation learning
                 save_name = os.path.join(
                     output_dir,
                     'faster_rcnn_{}_{}_{}_{}_norepr.pth'.format(args.session, args.net, args.dataset, group))
                 save_checkpoint({
                     'session': args.session,
                     'epoch': cfg.TRAIN.MAX_EPOCH,
-                    'model': (fasterRCNN.module if cfg.MGPU else fasterRCNN).state_dict(),
+                    'model': (fasterRCNN.module if (cfg.MGPU or distributed) else fasterRCNN).state_dict(),
                     'optimizer': optimizer.state_dict(),
                     'pooling_mode': cfg.POOLING_MODE,
                     'class_agnostic': args.class_agnostic,
@@ -355,89 +480,112 @@ if __name__ == '__main__':
                 tqdm.write('save model before representation learning: {}'.format(save_name))
 
             tqdm.write("===== Representation learning {} =====".format(group))
-            repr_labels = []
-            repr_features = []
-            repr_images = []
-            repr_score = []
-
-            # Walk through all examples
-            data_iter = iter(dataloader)
-            # fasterRCNN.eval()
-            for _ in trange(iters_per_epoch, desc="Repr", leave=True):
-                data = next(data_iter)
-                im_data.data.resize_(data[0].size()).copy_(data[0])
-                im_info.data.resize_(data[1].size()).copy_(data[1])
-                gt_boxes.data.resize_(data[2].size()).copy_(data[2])
-                num_boxes.data.resize_(data[3].size()).copy_(data[3])
-                im_path = list(data[4])
-
-                fasterRCNN.zero_grad()
-                rois, cls_prob, bbox_pred, bbox_raw, \
-                rpn_label, rpn_feature, rpn_cls_score, \
-                rois_label, pooled_feat, cls_score, \
-                rpn_loss_cls, rpn_loss_bbox, RCNN_loss_cls, RCNN_loss_bbox \
-                    = fasterRCNN(im_data, im_info, gt_boxes, num_boxes)
-                fasterRCNN.zero_grad()
-
-                Dtmp = torch.t(pooled_feat)
-                Dtot = Dtmp / torch.norm(Dtmp)
-                repr_features.append(Dtot.data.cpu().numpy().copy())
-                repr_labels.append(rois_label.data.cpu().numpy().copy())
-                repr_images.extend(flatten([[x] * rois.shape[1] for x in im_path]))
-
-            # Make representation of each class, and manage the examples
-            Dtot = np.concatenate(repr_features, axis=1)
-            labels = np.concatenate(repr_labels, axis=0)
-            labels = labels.ravel()
-
-            # If not use exemplar manage, we should start at now_cls_low, or it will cause error.
-            re_sta = 0 if (cfg.CIOD.REMEMBER_PROTO or group == 0) else now_cls_low
-            for ith in trange(re_sta, now_cls_high, desc="ClsMean"):
-                ind_cl = np.where(labels == ith)[0]
-                D = Dtot[:, ind_cl]
-                # Make class mean
-                tmp_mean = np.mean(D, axis=1)
-                cls_mean = tmp_mean / np.linalg.norm(tmp_mean)
-                class_means[:, ith] = torch.from_numpy(cls_mean)
-                # Example manage
-                dis = cdist(D.T, np.expand_dims(cls_mean, 0), 'euclidean').squeeze()
-                if cfg.CIOD.REMEMBER_PROTO and (ith or cfg.CIOD.REMEMBER_BG):
-                    # Sometimes we do not want to remember proto for all classes, so there is `and`
-                    # Sometimes, we want to remember proto for background (0) class, so there is `or`
-                    if cfg.CIOD.RANDOM_EM:
-                        sorted_index = np.random.permutation(len(dis))
-                    else:
-                        sorted_index = dis.argsort()
-
-                    cls_set = set()
-                    for idx in sorted_index:
-                        cls_set.add(repr_images[ind_cl[idx]])
-                        if len(cls_set) >= max_proto:
-                            break
-                    class_proto[ith] = list(cls_set)
-
-            if np.any(np.isnan(class_means.numpy())) or np.any(np.isinf(class_means.numpy())):
-                save_name = os.path.join(
-                    output_dir,
-                    'faster_rcnn_{}_{}_{}_{}_FAIL.pkl'.format(args.session, args.net, args.dataset, group))
-                pickle.dump(class_means, open("foo.pkl", "wb"))
-                assert False, "Nan or Inf occurred! Dumped ar {} for check".format(save_name)
-
-        # Save the model
-        save_name = os.path.join(
-            output_dir,
-            'faster_rcnn_{}_{}_{}_{}.pth'.format(args.session, args.net, args.dataset, group))
-        save_checkpoint({
-            'session': args.session,
-            'epoch': cfg.TRAIN.MAX_EPOCH,
-            'model': (fasterRCNN.module if cfg.MGPU else fasterRCNN).state_dict(),
-            'optimizer': optimizer.state_dict(),
-            'pooling_mode': cfg.POOLING_MODE,
-            'class_agnostic': args.class_agnostic,
-            'cls_means': class_means,
-            'cls_proto': class_proto
-        }, save_name)
-        tqdm.write('save model: {}'.format(save_name))
+            # The statistics must cover the full dataset and come out identical
+            # on every rank (class_proto decides the next group's roidb), so
+            # rank 0 walks an unsharded loader and broadcasts the results.
+            # The forward runs on the unwrapped net without autograd: a
+            # grad-less forward through the DDP wrapper would leave its
+            # reducer waiting for a backward that never comes.
+            if is_main_process:
+                repr_net = fasterRCNN.module if (cfg.MGPU or distributed) else fasterRCNN
+                repr_loader = dataloader
+                if distributed:
+                    repr_loader = torch.utils.data.DataLoader(
+                        dataset, batch_size=cfg.TRAIN.BATCH_SIZE,
+                        sampler=RcnnSampler(train_size, cfg.TRAIN.BATCH_SIZE),
+                        num_workers=min(16, os.cpu_count()), pin_memory=cfg.CUDA)
+                    if cfg.CUDA:
+                        repr_loader = CudaPrefetcher(repr_loader, device)
+
+                repr_labels = []
+                repr_features = []
+                repr_images = []
+                repr_score = []
+
+                # Walk through all examples
+                # repr_net.eval()
+                with torch.no_grad():
+                    for data in tqdm(repr_loader, desc="Repr", leave=True):
+                        im_data = data[0].to(device, non_blocking=True, memory_format=torch.channels_last)
+                        im_info = data[1].to(device, non_blocking=True)
+                        gt_boxes = data[2].to(device, non_blocking=True)
+                        num_boxes = data[3].to(device, non_blocking=True)
+                        im_path = list(data[4])
+
+                        rois, cls_prob, bbox_pred, bbox_raw, \
+                        rpn_label, rpn_feature, rpn_cls_score, \
+                        rois_label, pooled_feat, cls_score, \
+                        rpn_loss_cls, rpn_loss_bbox, RCNN_loss_cls, RCNN_loss_bbox \
+                            = repr_net(im_data, im_info, gt_boxes, num_boxes)
+
+                        Dtmp = torch.t(pooled_feat)
+                        Dtot = Dtmp / torch.norm(Dtmp)
+                        repr_features.append(Dtot.data.cpu().numpy().copy())
+                        repr_labels.append(rois_label.data.cpu().numpy().copy())
+                        repr_images.extend(flatten([[x] * rois.shape[1] for x in im_path]))
+
+                # Make representation of each class, and manage the examples
+                Dtot = np.concatenate(repr_features, axis=1)
+                labels = np.concatenate(repr_labels, axis=0)
+                labels = labels.ravel()
+
+                # If not use exemplar manage, we should start at now_cls_low, or it will cause error.
+                re_sta = 0 if (cfg.CIOD.REMEMBER_PROTO or group == 0) else now_cls_low
+                for ith in trange(re_sta, now_cls_high, desc="ClsMean"):
+                    ind_cl = np.where(labels == ith)[0]
+                    D = Dtot[:, ind_cl]
+                    # Make class mean
+                    tmp_mean = np.mean(D, axis=1)
+                    cls_mean = tmp_mean / np.linalg.norm(tmp_mean)
+                    class_means[:, ith] = torch.from_numpy(cls_mean)
+                    # Example manage
+                    dis = cdist(D.T, np.expand_dims(cls_mean, 0), 'euclidean').squeeze()
+                    if cfg.CIOD.REMEMBER_PROTO and (ith or cfg.CIOD.REMEMBER_BG):
+                        # Sometimes we do not want to remember proto for all classes, so there is `and`
+                        # Sometimes, we want to remember proto for background (0) class, so there is `or`
+                        if cfg.CIOD.RANDOM_EM:
+                            sorted_index = np.random.permutation(len(dis))
+                        else:
+                            sorted_index = dis.argsort()
+
+                        cls_set = set()
+                        for idx in sorted_index:
+                            cls_set.add(repr_images[ind_cl[idx]])
+                            if len(cls_set) >= max_proto:
+                                break
+                        class_proto[ith] = list(cls_set)
+
+                if np.any(np.isnan(class_means.numpy())) or np.any(np.isinf(class_means.numpy())):
+                    save_name = os.path.join(
+                        output_dir,
+                        'faster_rcnn_{}_{}_{}_{}_FAIL.pkl'.format(args.session, args.net, args.dataset, group))
+                    pickle.dump(class_means, open("foo.pkl", "wb"))
+                    assert False, "Nan or Inf occurred! Dumped ar {} for check".format(save_name)
+
+            if distributed:
+                # Every rank builds the next group's roidb from class_proto,
+                # so all of them must agree on rank 0's statistics.
+                sync = [class_means, class_proto]
+                dist.broadcast_object_list(sync, src=0)
+                class_means, class_proto = sync
+
+        # Save the model (only once when running multi-process)
+        if is_main_process:
+            save_name = os.path.join(
+                output_dir,
+                'faster_rcnn_{}_{}_{}_{}.pth'.format(args.session, args.net, args.dataset, group))
+            save_checkpoint({
+                'session': args.session,
+                'epoch': cfg.TRAIN.MAX_EPOCH,
+                'model': (fasterRCNN.module if (cfg.MGPU or distributed) else fasterRCNN).state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'pooling_mode': cfg.POOLING_MODE,
+                'class_agnostic': args.class_agnostic,
+                'cls_means': class_means,
+                'cls_proto': class_proto
+            }, save_name)
+            tqdm.write('save model: {}'.format(save_name))
         print("{0} Group {1} Done {0}".format('=' * 10, group), end="\n" * 5)
 
+    log_queue.join()  # flush pending scalars before the daemon thread dies
     print("{0} All Done {0}".format('=' * 10), end="\n" * 5)